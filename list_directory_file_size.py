@@ -3,11 +3,14 @@ import socket
 import machine
 import utime
 from time import sleep, localtime
-from machine import Pin, ADC
+from machine import Pin, ADC, PWM, Timer
 import gc
 import urequests
 import uos
 import json
+import ntptime
+from array import array
+from micropython import const
 
 # Wi-Fi credentials
 ssid = 'VM5792329'
@@ -16,6 +19,127 @@ password = 'rk2dqJpcGyjd'
 # URL of the raw GitHub file
 url = "https://raw.githubusercontent.com/nomad-49/auto-watering2/main/list_directory_file_size.py"
 local_file = "main.py"
+calibration_file = "calibration.json"
+budget_file = "pump_budget.json"
+clock_synced = False  # The RTC starts at 2021-01-01 until NTP has set it
+
+# Lookup tables cover the 16-bit ADC range in 256 steps, interpolated in between
+LUT_SHIFT = 8
+LUT_MASK = (1 << LUT_SHIFT) - 1
+LUT_SIZE = (65536 >> LUT_SHIFT) + 1
+
+# Log levels
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+class Logger:
+    def __init__(self, level, capacity, log_file, max_log_bytes, log_file_count):
+        self.level = level
+        self.capacity = capacity
+        self.log_file = log_file
+        self.max_log_bytes = max_log_bytes
+        self.log_file_count = log_file_count
+        # Preallocated ring buffer; messages are formatted only when drained or served
+        self.times = array('I', bytes(4 * capacity))
+        self.levels = bytearray(capacity)
+        self.messages = [None] * capacity
+        self.args = [None] * capacity
+        self.next_seq = 0
+        self.drained_seq = 0
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def write(self, level, message, args):
+        if level < self.level:
+            return  # Disabled levels cost no formatting
+        slot = self.next_seq % self.capacity
+        self.times[slot] = utime.time()
+        self.levels[slot] = level
+        self.messages[slot] = message
+        self.args[slot] = args
+        self.next_seq += 1
+
+    def debug(self, message, *args):
+        self.write(DEBUG, message, args)
+
+    def info(self, message, *args):
+        self.write(INFO, message, args)
+
+    def warning(self, message, *args):
+        self.write(WARNING, message, args)
+
+    def error(self, message, *args):
+        self.write(ERROR, message, args)
+
+    def oldest_seq(self):
+        return max(0, self.next_seq - self.capacity)
+
+    def format_message(self, slot):
+        message = self.messages[slot]
+        args = self.args[slot]
+        if args:
+            try:
+                message = message % args
+            except Exception:
+                message = f"{message} {args}"
+        return message
+
+    def format_entry(self, seq):
+        slot = seq % self.capacity
+        return f"{self.times[slot]} {LEVEL_NAMES.get(self.levels[slot], self.levels[slot])} {self.format_message(slot)}"
+
+    def entries_since(self, since):
+        return [(seq, self.format_entry(seq)) for seq in range(max(since, self.oldest_seq()), self.next_seq)]
+
+    def rotate(self):
+        try:
+            uos.remove(f"{self.log_file}.{self.log_file_count - 1}")
+        except OSError:
+            pass
+        for index in range(self.log_file_count - 2, 0, -1):
+            try:
+                uos.rename(f"{self.log_file}.{index}", f"{self.log_file}.{index + 1}")
+            except OSError:
+                pass
+        try:
+            uos.rename(self.log_file, f"{self.log_file}.1")
+        except OSError:
+            pass
+
+    def flush(self):
+        # Drains pending entries to serial and flash; called outside request handling
+        if self.drained_seq == self.next_seq:
+            return
+        lines = []
+        if self.drained_seq < self.oldest_seq():
+            lines.append(f"{utime.time()} WARNING Log buffer overrun, dropped {self.oldest_seq() - self.drained_seq} entries")
+            self.drained_seq = self.oldest_seq()
+        while self.drained_seq < self.next_seq:
+            slot = self.drained_seq % self.capacity
+            if self.args[slot]:
+                # Keep only the formatted text so exceptions and request paths are released
+                self.messages[slot] = self.format_message(slot)
+                self.args[slot] = None
+            lines.append(self.format_entry(self.drained_seq))
+            self.drained_seq += 1
+        for line in lines:
+            print(line)  # Print to Thonny's console for visibility
+        try:
+            try:
+                if uos.stat(self.log_file)[6] >= self.max_log_bytes:
+                    self.rotate()
+            except OSError:
+                pass  # No log file yet
+            with open(self.log_file, 'a') as f:
+                for line in lines:
+                    f.write(line)
+                    f.write("\n")
+        except Exception as e:
+            print(f"Error writing log file: {e}")
 
 class WiFiManager:
     def __init__(self, ssid, password):
@@ -27,7 +151,7 @@ class WiFiManager:
         wlan.active(True)
         
         for attempt in range(1, max_attempts + 1):
-            print(f'Connection attempt {attempt}')
+            logger.info('Connection attempt %d', attempt)
             wlan.connect(self.ssid, self.password)
             
             attempt_wait_time = wait_time
@@ -35,110 +159,357 @@ class WiFiManager:
                 if wlan.status() < 0 or wlan.status() >= 3:
                     break
                 attempt_wait_time -= 1
-                print('waiting for connection...')
+                logger.info('waiting for connection...')
+                logger.flush()  # Already blocking here, show progress straight away
                 sleep(3)
 
             if wlan.status() == 3:
-                print('connected')
+                logger.info('connected')
                 status = wlan.ifconfig()
-                print('ip = ' + status[0])
+                logger.info('ip = %s', status[0])
+                sync_clock()
                 return status[0]
             else:
-                print(f'Connection attempt {attempt} failed')
+                logger.warning('Connection attempt %d failed', attempt)
 
         raise RuntimeError('network connection failed')
 
     def reconnect(self):
-        print("Attempting to reconnect to Wi-Fi...")
+        logger.warning("Attempting to reconnect to Wi-Fi...")
         ip = self.connect_wifi()
         return open_socket(ip)
 
 
 class PumpController:
-    def __init__(self, pump_pin, moisture_threshold, max_pump_time, cooldown_time):
+    def __init__(self, pump_pin, moisture_threshold, max_pump_time, cooldown_time, daily_pump_budget, soft_start_ms=0):
         self.pump_pin = pump_pin
         self.moisture_threshold = moisture_threshold
         self.max_pump_time = max_pump_time
         self.cooldown_time = cooldown_time
+        self.daily_pump_budget = daily_pump_budget  # Total seconds the pump may run per day
+        self.soft_start_ms = soft_start_ms  # 0 disables the PWM ramp
         self.pump_state = False
         self.last_pump_activation = 0
         self.last_pump_deactivation = 0
+        self.pump_started_ms = 0
+        self.pump_stopped_ms = 0  # Set when the pin actually goes off, including from the IRQ
+        self.pump_ms_today = 0
+        self.budget_day = [localtime()[0], localtime()[7]]  # [year, day of year]
         self.cooldown_active = False
+        self.cutoff_pending = False
         self.pump_log = []
+        self.cutoff_timer = Timer()
+        self.cutoff_callback = self.safety_cutoff  # Bound once so the IRQ does not allocate
+        self.load_budget()
+
+    def safety_cutoff(self, timer):
+        # Runs from the timer IRQ: switch the pin off, note when, and flag the rest for the main loop
+        self.pump_pin.off()
+        if self.pump_state:
+            self.pump_stopped_ms = utime.ticks_ms()
+            self.pump_state = False
+            self.cutoff_pending = True
+
+    def load_budget(self):
+        try:
+            with open(budget_file, 'r') as f:
+                budget = json.load(f)
+            self.budget_day = [int(budget["day"][0]), int(budget["day"][1])]
+            self.pump_ms_today = int(budget["pump_ms_today"])
+            logger.info("Loaded pump budget: %d ms used", self.pump_ms_today)
+        except OSError:
+            pass  # No saved budget yet, start from zero
+        except Exception as e:
+            logger.error("Error loading pump budget: %s", e)
+
+    def save_budget(self):
+        try:
+            with open(budget_file, 'w') as f:
+                json.dump({"day": self.budget_day, "pump_ms_today": self.pump_ms_today}, f)
+        except Exception as e:
+            logger.error("Error saving pump budget: %s", e)
+
+    def reset_budget(self):
+        self.pump_ms_today = 0
+        self.save_budget()
+        logger.info("Pump budget reset")
+
+    def remaining_budget_ms(self):
+        today = [localtime()[0], localtime()[7]]
+        # Without a synced clock the day is unknown, so keep charging the saved day
+        if clock_synced and today != self.budget_day:
+            self.budget_day = today
+            self.pump_ms_today = 0
+        return max(0, self.daily_pump_budget * 1000 - self.pump_ms_today)
+
+    def soft_start(self):
+        pwm = None
+        try:
+            pwm = PWM(self.pump_pin)
+            pwm.freq(1000)
+            steps = 10
+            for step in range(1, steps + 1):
+                pwm.duty_u16(65535 * step // steps)
+                utime.sleep_ms(self.soft_start_ms // steps)
+        finally:
+            # Always hand the pin back as a plain output, so pump_pin.off() can stop it
+            if pwm is not None:
+                pwm.deinit()
+            self.pump_pin.init(Pin.OUT)
 
     def activate_pump(self):
         try:
+            self.handle_cutoff()
             if not self.pump_state:
+                run_time_ms = min(self.max_pump_time * 1000, self.remaining_budget_ms())
+                if run_time_ms <= 0:
+                    logger.warning("Daily pump budget used up, not activating pump")
+                    return
+                # The ramp counts towards the run time and the budget
+                self.pump_started_ms = utime.ticks_ms()
+                self.last_pump_activation = utime.time()
+                if self.soft_start_ms > 0:
+                    self.soft_start()
                 self.pump_pin.on()
                 self.pump_state = True
-                self.last_pump_activation = utime.time()
+                run_time_ms = max(1, run_time_ms - utime.ticks_diff(utime.ticks_ms(), self.pump_started_ms))
+                self.cutoff_timer.init(mode=Timer.ONE_SHOT, period=run_time_ms, callback=self.cutoff_callback)
                 self.pump_log.append(f"Pump Activated ({localtime_to_string(localtime())} for 0 seconds)")  # Initialize with 0 seconds
                 if len(self.pump_log) > 10:  # Limit the pump log to 10 entries
                     self.pump_log.pop(0)
-                print("Pump activated")
+                logger.info("Pump activated")
         except Exception as e:
-            log(f"Error activating pump: {e}")
+            self.cutoff_timer.deinit()
+            self.pump_pin.off()
+            self.pump_state = False
+            logger.error("Error activating pump: %s", e)
+
+    def record_deactivation(self):
+        # May run well after the pump stopped, so everything is measured from pump_stopped_ms
+        run_ms = utime.ticks_diff(self.pump_stopped_ms, self.pump_started_ms)
+        self.pump_ms_today += run_ms
+        self.save_budget()
+        self.pump_log[-1] = self.pump_log[-1].replace("0 seconds", f"{run_ms // 1000} seconds")
+        self.cooldown_active = True  # Start cooldown period
+        self.last_pump_deactivation = utime.time() - utime.ticks_diff(utime.ticks_ms(), self.pump_stopped_ms) // 1000
 
     def deactivate_pump(self):
         try:
-            if self.pump_state:
-                self.pump_pin.off()
-                self.pump_state = False
-                duration = int(utime.time() - self.last_pump_activation)
-                self.pump_log[-1] = self.pump_log[-1].replace("0 seconds", f"{duration} seconds")
-                self.cooldown_active = True  # Start cooldown period
-                self.last_pump_deactivation = utime.time()
-                print("Pump deactivated")
+            self.handle_cutoff()
+            self.cutoff_timer.deinit()
+            irq_state = machine.disable_irq()
+            was_running = self.pump_state
+            self.pump_pin.off()
+            if was_running:
+                self.pump_stopped_ms = utime.ticks_ms()
+            self.pump_state = False
+            machine.enable_irq(irq_state)
+            if was_running:
+                self.record_deactivation()
+                logger.info("Pump deactivated")
         except Exception as e:
-            log(f"Error deactivating pump: {e}")
+            logger.error("Error deactivating pump: %s", e)
+
+    def handle_cutoff(self):
+        if self.cutoff_pending:
+            self.cutoff_pending = False
+            self.record_deactivation()
+            logger.warning("Pump stopped by safety cutoff")
 
     def handle_pump_logic(self, moisture, pump_control_override):
+        self.handle_cutoff()
         current_time = utime.time()
         if not pump_control_override:
             if moisture < self.moisture_threshold and not self.cooldown_active:
                 if not self.pump_state:
                     self.activate_pump()
-                elif self.pump_state and (current_time - self.last_pump_activation >= self.max_pump_time):
-                    self.deactivate_pump()
             elif moisture >= self.moisture_threshold:
                 if self.pump_state:
                     self.deactivate_pump()
 
+        # max_pump_time is enforced by cutoff_timer alone
         if self.cooldown_active and (current_time - self.last_pump_deactivation >= self.cooldown_time):
             self.cooldown_active = False
 
-        if not pump_control_override and self.pump_state and (current_time - self.last_pump_activation >= self.max_pump_time):
-            self.deactivate_pump()
-
 
 class SensorManager:
-    def __init__(self, moisture_pin, temp_sensor, conversion_factor, dry_value, wet_value):
+    def __init__(self, moisture_pin, temp_sensor, conversion_factor, dry_value, wet_value, auto_calibrate=False, calibration_band=(20000, 64000),
+                 min_calibration_span=2000, calibration_samples=5, calibration_tolerance=500, calibration_rebuild_interval=60, calibration_save_interval=600):
         self.moisture_pin = moisture_pin
         self.temp_sensor = temp_sensor
         self.conversion_factor = conversion_factor
+        self.default_dry_value = dry_value
+        self.default_wet_value = wet_value
         self.dry_value = dry_value
         self.wet_value = wet_value
+        self.auto_calibrate = auto_calibrate
+        self.calibration_band = calibration_band  # Inverted readings outside this band are glitches or a disconnected probe
+        self.min_calibration_span = min_calibration_span
+        self.calibration_samples = calibration_samples  # Consecutive filtered samples needed to accept a new extreme
+        self.calibration_tolerance = calibration_tolerance  # How close a reading must be to the filtered value to count as settled
+        self.calibration_rebuild_interval = calibration_rebuild_interval
+        self.calibration_save_interval = calibration_save_interval
+        self.filtered_moisture = None
+        self.observed_min = None
+        self.observed_max = None
+        self.dry_observed = False  # Each default bound is kept until that side has been seen
+        self.wet_observed = False
+        self.low_count = 0
+        self.high_count = 0
+        self.calibration_pending = False
+        self.calibration_dirty = False
+        self.last_calibration_rebuild = utime.time()
+        self.last_calibration_save = utime.time()
+        self.moisture_table = array('h', bytes(2 * LUT_SIZE))  # Tenths of a percent, unclamped
+        self.temperature_table = array('h', bytes(2 * LUT_SIZE))  # Tenths of a degree
+        self.load_calibration()
+        self.build_moisture_table()
+        self.build_temperature_table()
 
-    def read_moisture(self):
+    def plausible(self, value):
+        return self.calibration_band[0] <= value <= self.calibration_band[1]
+
+    def load_calibration(self):
+        try:
+            with open(calibration_file, 'r') as f:
+                calibration = json.load(f)
+            dry = int(calibration["dry_value"])
+            wet = int(calibration["wet_value"])
+            if self.plausible(dry) and self.plausible(wet) and wet - dry >= self.min_calibration_span:
+                self.observed_min = self.dry_value = dry
+                self.observed_max = self.wet_value = wet
+                self.dry_observed = True
+                self.wet_observed = True
+                logger.info("Loaded calibration: dry=%d, wet=%d", dry, wet)
+            else:
+                logger.warning("Ignoring implausible calibration: dry=%d, wet=%d", dry, wet)
+        except OSError:
+            pass  # No saved calibration yet, keep the defaults
+        except Exception as e:
+            logger.error("Error loading calibration: %s", e)
+
+    def save_calibration(self):
+        try:
+            with open(calibration_file, 'w') as f:
+                json.dump({"dry_value": self.dry_value, "wet_value": self.wet_value}, f)
+            self.calibration_dirty = False
+            self.last_calibration_save = utime.time()
+            logger.info("Saved calibration: dry=%d, wet=%d", self.dry_value, self.wet_value)
+        except Exception as e:
+            logger.error("Error saving calibration: %s", e)
+
+    def reset_calibration(self):
+        self.dry_value = self.default_dry_value
+        self.wet_value = self.default_wet_value
+        self.filtered_moisture = None
+        self.observed_min = None
+        self.observed_max = None
+        self.dry_observed = False
+        self.wet_observed = False
+        self.low_count = 0
+        self.high_count = 0
+        self.calibration_pending = False
+        self.calibration_dirty = False
+        self.build_moisture_table()
+        try:
+            uos.remove(calibration_file)
+        except OSError:
+            pass
+        logger.info("Calibration reset to defaults: dry=%d, wet=%d", self.dry_value, self.wet_value)
+
+    def build_moisture_table(self):
+        # Rebuilt in place only when the calibration changes
+        span = self.wet_value - self.dry_value
+        for i in range(LUT_SIZE):
+            tenths = ((i << LUT_SHIFT) - self.dry_value) * 1000 // span
+            self.moisture_table[i] = max(-32768, min(tenths, 32767))
+
+    def build_temperature_table(self):
+        for i in range(LUT_SIZE):
+            reading = min(i << LUT_SHIFT, 65535) * self.conversion_factor
+            self.temperature_table[i] = int(round((27 - (reading - 0.706) / 0.001721) * 10))
+
+    def update_calibration(self, inverted_moisture):
+        # Track the probe's own extremes from a filtered value; a new extreme must hold for several settled samples
+        if self.filtered_moisture is None:
+            self.filtered_moisture = inverted_moisture
+        else:
+            self.filtered_moisture += (inverted_moisture - self.filtered_moisture) >> 3
+        filtered = self.filtered_moisture
+        if not self.plausible(inverted_moisture) or not self.plausible(filtered) or abs(inverted_moisture - filtered) > self.calibration_tolerance:
+            self.low_count = 0
+            self.high_count = 0
+            return
+        if self.observed_min is None:
+            self.observed_min = filtered
+            self.observed_max = filtered
+        elif filtered < self.observed_min:
+            self.high_count = 0
+            self.low_count += 1
+            if self.low_count >= self.calibration_samples:
+                self.observed_min = filtered
+                self.low_count = 0
+                self.dry_observed = True
+                self.calibration_pending = True
+        elif filtered > self.observed_max:
+            self.low_count = 0
+            self.high_count += 1
+            if self.high_count >= self.calibration_samples:
+                self.observed_max = filtered
+                self.high_count = 0
+                self.wet_observed = True
+                self.calibration_pending = True
+        else:
+            self.low_count = 0
+            self.high_count = 0
+        # Debounced so a drying bed does not rebuild the table on every reading
+        if self.calibration_pending and utime.time() - self.last_calibration_rebuild >= self.calibration_rebuild_interval:
+            self.apply_calibration()
+
+    def apply_calibration(self):
+        self.calibration_pending = False
+        self.last_calibration_rebuild = utime.time()
+        # Only a side that has produced an accepted extreme replaces its default
+        dry = self.observed_min if self.dry_observed else self.default_dry_value
+        wet = self.observed_max if self.wet_observed else self.default_wet_value
+        if wet - dry < self.min_calibration_span:
+            return  # Not enough range yet, keep the current calibration
+        if dry == self.dry_value and wet == self.wet_value:
+            return
+        self.dry_value = dry
+        self.wet_value = wet
+        self.build_moisture_table()
+        self.calibration_dirty = True
+
+    def maybe_save_calibration(self):
+        # Rate-limited so tracking extremes does not wear out the flash
+        if self.calibration_dirty and utime.time() - self.last_calibration_save >= self.calibration_save_interval:
+            self.save_calibration()
+
+    def read_moisture_tenths(self):
         try:
-            moisture_value = self.moisture_pin.read_u16()
-            inverted_moisture = 65535 - moisture_value
-            moisture_percentage = ((inverted_moisture - self.dry_value) / (self.wet_value - self.dry_value)) * 100
-            moisture_percentage = max(0, min(moisture_percentage, 100))
-            return moisture_percentage
+            inverted_moisture = 65535 - self.moisture_pin.read_u16()
+            if self.auto_calibrate:
+                self.update_calibration(inverted_moisture)
+            # Clamp after interpolating so the 0% and 100% corners stay sharp
+            return max(0, min(lookup(self.moisture_table, inverted_moisture), 1000))
         except Exception as e:
-            log(f"Error reading moisture: {e}")
+            logger.error("Error reading moisture: %s", e)
             return 0  # Return a default value in case of error
 
-    def read_temperature(self):
+    def read_temperature_tenths(self):
         try:
-            reading = self.temp_sensor.read_u16() * self.conversion_factor
-            temperature = 27 - (reading - 0.706) / 0.001721
-            return temperature
+            return lookup(self.temperature_table, self.temp_sensor.read_u16())
         except Exception as e:
-            log(f"Error reading temperature: {e}")
+            logger.error("Error reading temperature: %s", e)
             return 0  # Return a default value in case of error
 
+    def read_moisture(self):
+        return self.read_moisture_tenths() / 10
+
+    def read_temperature(self):
+        return self.read_temperature_tenths() / 10
+
 
 class WebServer:
     def __init__(self, wifi_manager, pump_controller, sensor_manager):
@@ -188,7 +559,21 @@ class WebServer:
             if request_path.startswith('/autowater'):
                 self.pump_control_override = False
                 self.led_override = False  # Turn off LED override when autowater is enabled
-                print("Autowater activated. Automatic control re-enabled.")
+                logger.info("Autowater activated. Automatic control re-enabled.")
+                return '200 OK', None
+            if request_path.startswith('/budget?action=reset'):
+                self.pump_controller.reset_budget()
+                return '200 OK', None
+            if request_path.startswith('/calibration?action=reset'):
+                self.sensor_manager.reset_calibration()
+                return '200 OK', None
+            if request_path.startswith('/calibration?action=auto'):
+                self.sensor_manager.auto_calibrate = True
+                logger.info("Auto-calibration enabled")
+                return '200 OK', None
+            if request_path.startswith('/calibration?action=manual'):
+                self.sensor_manager.auto_calibrate = False
+                logger.info("Auto-calibration disabled")
                 return '200 OK', None
             if request_path.startswith('/threshold'):
                 threshold_value = request_path.split('=')[1]
@@ -211,13 +596,31 @@ class WebServer:
             if request_path.startswith('/pumplog'):
                 pump_log_html = "".join([f"<p>{entry}</p>" for entry in self.pump_controller.pump_log])
                 return '200 OK', pump_log_html
+            if request_path.startswith('/loglevel'):
+                if 'value=' not in request_path:
+                    return '400 Bad Request', 'Missing log level'
+                level_name = request_path.split('value=')[1].upper()
+                for level, name in LEVEL_NAMES.items():
+                    if name == level_name:
+                        logger.level = level
+                        return '200 OK', name
+                return '400 Bad Request', 'Invalid log level'
+            if request_path.startswith('/logs'):
+                since = 0
+                if 'since=' in request_path:
+                    try:
+                        since = int(request_path.split('since=')[1])
+                    except ValueError:
+                        return '400 Bad Request', 'Invalid since value'
+                response = json.dumps({"next": logger.next_seq, "entries": logger.entries_since(since)})
+                return '200 OK', response
             if request_path.startswith('/update'):
                 update_status = fetch_and_update()
                 self.update_message = update_status
                 response = json.dumps({"message": update_status})
                 return '200 OK', response
         except Exception as e:
-            log(f"Error handling request {request_path}: {e}")
+            logger.error("Error handling request %s: %s", request_path, e)
 
         return '404 Not Found', '<h1>404 Not Found</h1>'
 
@@ -229,9 +632,9 @@ class WebServer:
                 self.led.on()
             else:
                 self.led.off()
-            log(f"LED {'on' if state else 'off'}")
+            logger.info("LED %s", 'on' if state else 'off')
         except Exception as e:
-            log(f"Error controlling LED: {e}")
+            logger.error("Error controlling LED: %s", e)
 
     def run(self):
         ip = self.wifi_manager.connect_wifi()
@@ -248,8 +651,8 @@ class WebServer:
                 request = request.decode('utf-8')
                 request_path = request.split(' ')[1]
 
-                if request_path != '/data' and request_path != '/pumplog':
-                    print(f'Request Path: {request_path}')
+                if logger.enabled(DEBUG) and request_path != '/data' and request_path != '/pumplog' and not request_path.startswith('/log'):
+                    logger.debug('Request Path: %s', request_path)
 
                 status, response = self.handle_request(request_path)
                 moisture = self.sensor_manager.read_moisture()
@@ -270,7 +673,7 @@ class WebServer:
 
                 self.pump_controller.handle_pump_logic(moisture, self.pump_control_override)
 
-                if request_path == '/data' or request_path == '/pumplog':
+                if request_path == '/data' or request_path == '/pumplog' or request_path.startswith('/logs') or request_path.startswith('/loglevel'):
                     client.send(f'HTTP/1.1 {status}\r\n')
                     client.send('Content-Type: text/html\r\n')
                     client.send('Connection: close\r\n\r\n')
@@ -282,6 +685,7 @@ class WebServer:
                     client.send('Connection: close\r\n\r\n')
                     client.sendall(response.encode('utf-8'))
                 client.close()
+                logger.flush()  # Drain the log once the client has its response
 
                 if not self.led_override:
                     self.led_state = not self.led_state
@@ -289,10 +693,16 @@ class WebServer:
                     utime.sleep(0.5)
 
                 if current_time - self.last_check_time > self.watchdog_timeout:
-                    print("Software watchdog reset")
+                    logger.warning("Software watchdog reset")
+                    logger.flush()
                     machine.reset()
                 self.last_check_time = current_time
 
+                self.sensor_manager.maybe_save_calibration()
+
+                if not clock_synced and current_time % 300 == 0:  # Retry NTP every 5 minutes until it works
+                    sync_clock()
+
                 if current_time % 30 == 0:  # Run garbage collection every 30 seconds
                     gc.collect()
 
@@ -300,15 +710,28 @@ class WebServer:
                     connection = self.wifi_manager.reconnect()
 
             except Exception as e:
-                print(f'An error occurred: {e}')
+                logger.error('An error occurred: %s', e)
+                logger.flush()
                 if not self.wlan.isconnected():
                     connection = self.wifi_manager.reconnect()
                 else:
                     sleep(1)  # Small delay before continuing
 
 # Auxiliary functions
-def log(message):
-    print(message)  # Print to Thonny's console for visibility
+def lookup(table, raw):
+    # Piecewise-linear interpolation between table entries, integer-only
+    index = raw >> LUT_SHIFT
+    low = table[index]
+    return low + (((table[index + 1] - low) * (raw & LUT_MASK)) >> LUT_SHIFT)
+
+def sync_clock():
+    global clock_synced
+    try:
+        ntptime.settime()  # Sets the RTC to UTC
+        clock_synced = True
+        logger.info("Clock synced: %s", localtime_to_string(localtime()))
+    except Exception as e:
+        logger.warning("Clock sync failed: %s", str(e))
 
 def localtime_to_string(time_tuple):
     return "{:02}/{:02}/{} at {:02}:{:02}:{:02}".format(time_tuple[2], time_tuple[1], time_tuple[0], time_tuple[3], time_tuple[4], time_tuple[5])
@@ -316,11 +739,11 @@ def localtime_to_string(time_tuple):
 def fetch_and_update():
     temp_file = "temp_main.py"
     try:
-        log("Checking for updates.")
+        logger.info("Checking for updates.")
         gc.collect()  # Force garbage collection to free up memory
         response = urequests.get(url)
         if response.status_code == 200:
-            log("Successfully fetched the remote file.")
+            logger.info("Successfully fetched the remote file.")
             # Open a temporary file to write the downloaded content
             with open(temp_file, 'wb') as f:
                 while True:
@@ -341,20 +764,21 @@ def fetch_and_update():
                 local_code = b""
 
             if remote_code != local_code:
-                log("Update found. Updating the local file.")
+                logger.info("Update found. Updating the local file.")
                 with open(local_file, 'wb') as f:
                     f.write(remote_code)
-                log("Restarting the device to run the updated code.")
+                logger.info("Restarting the device to run the updated code.")
+                logger.flush()
                 uos.remove(temp_file)  # Remove the temporary file before reset
                 machine.reset()  # Restart the device to run the updated code
             else:
-                log("No updates found. Local file is up to date.")
+                logger.info("No updates found. Local file is up to date.")
                 return "No new software available"
         else:
-            log(f"Failed to fetch the file. Status code: {response.status_code}")
+            logger.error("Failed to fetch the file. Status code: %d", response.status_code)
             return "Failed to fetch the update"
     except Exception as e:
-        log(f"Error fetching or updating the file: {str(e)}")
+        logger.error("Error fetching or updating the file: %s", e)
         return f"Error: {str(e)}"
     finally:
         # Ensure the temporary file is deleted
@@ -681,20 +1105,27 @@ def webpage(temperature, state, moisture, auto_water, data_points, threshold, up
     return str(html)
 
 # Initialize components
+log_level = INFO  # DEBUG also records every request path
+logger = Logger(log_level, 64, "log.txt", 8192, 3)
 moisture_pin = ADC(26)
 pump_pin = Pin(16, Pin.OUT)
 temp_sensor = ADC(4)
 conversion_factor = 3.3 / (65535)
 dry_value = 43000
 wet_value = 50000
+# Set auto_calibrate to True to learn dry/wet values from the probe. The probe must then see both fully
+# dry and fully wet soil, otherwise a partial drift gets mapped onto the 0-100% scale. Reset with /calibration?action=reset
+auto_calibrate = False
 moisture_threshold = 30.0
 max_pump_time = 60  # 60 seconds
 cooldown_time = 30  # 30 seconds
+daily_pump_budget = 600  # 10 minutes of pumping per UTC day, manual runs included; reset with /budget?action=reset
+pump_soft_start_ms = 0  # Set to e.g. 500 to ramp the pump up with PWM
 
 # Instantiate classes
 wifi_manager = WiFiManager(ssid, password)
-pump_controller = PumpController(pump_pin, moisture_threshold, max_pump_time, cooldown_time)
-sensor_manager = SensorManager(moisture_pin, temp_sensor, conversion_factor, dry_value, wet_value)
+pump_controller = PumpController(pump_pin, moisture_threshold, max_pump_time, cooldown_time, daily_pump_budget, pump_soft_start_ms)
+sensor_manager = SensorManager(moisture_pin, temp_sensor, conversion_factor, dry_value, wet_value, auto_calibrate)
 web_server = WebServer(wifi_manager, pump_controller, sensor_manager)
 
 # Run the web server